@@ -1,12 +1,18 @@
+import csv
+import io
 import os
+import re
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlparse
 
+import orjson
 import requests
-import pandas as pd
 import streamlit as st
-from serpapi import GoogleSearch
+
+from csv_scraper.session import retrying_session
 
 st.set_page_config(page_title="NZ Job Scraper for Clients", page_icon="🧑‍💼", layout="wide")
 st.title("🧑‍💼 NZ Job Scraper for Clients")
@@ -23,56 +29,168 @@ AIRTABLE_VIEW = get_secret("AIRTABLE_VIEW", "Grid view")
 AIRTABLE_CLIENT_FIELD = get_secret("AIRTABLE_CLIENT_FIELD", "Full Name")
 AIRTABLE_CLIENT_PROF_FIELD = get_secret("AIRTABLE_CLIENT_PROF_FIELD", "Profession")
 
+# Column order for job rows, shared by the table view and the CSV export
+JOB_COLUMNS = (
+    "Source",
+    "Position Title",
+    "Company Name",
+    "Location",
+    "Posted",
+    "Application Weblink",
+    "Description",
+)
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+# --- HTTP session ---
+@st.cache_resource
+def http_session() -> requests.Session:
+    """
+    One pooled session for Airtable and SerpAPI, kept across reruns so
+    connections stay alive. Auth headers are passed per request so the
+    Airtable token is never sent to SerpAPI.
+    """
+    return retrying_session()
+
 # --- Airtable fetch ---
-@st.cache_data(ttl=300)
-def fetch_clients():
-    if not all([AIRTABLE_API_KEY, AIRTABLE_BASE_ID, AIRTABLE_CLIENTS_TABLE]):
-        return []
+@st.cache_data(ttl=600, max_entries=4, show_spinner=False)
+def fetch_clients(base_id: str, table: str, view: str, name_field: str, prof_field: str, _api_key: str):
+    """
+    Secrets are passed in explicitly so they form the cache key; the API key
+    is underscore-prefixed so Streamlit never hashes it.
+    Returns clients keyed by name in table order, so the UI can look up the
+    selected client directly; the first record wins for duplicate names.
+    Request errors propagate so a failed fetch is not cached; the caller
+    reports them.
+    """
+    if not all([_api_key, base_id, table]):
+        return {}
     
-    url = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{requests.utils.quote(AIRTABLE_CLIENTS_TABLE)}"
-    headers = {"Authorization": f"Bearer {AIRTABLE_API_KEY}"}
-    params = {}
-    if AIRTABLE_VIEW:
-        params["view"] = AIRTABLE_VIEW
+    url = f"https://api.airtable.com/v0/{base_id}/{requests.utils.quote(table)}"
+    headers = {"Authorization": f"Bearer {_api_key}"}
+    # Airtable's max page size; offsets are opaque cursors, so pages can only
+    # be walked one after another and fewer, larger pages is the main lever.
+    params = {
+        "pageSize": 100,
+        # Only download the two columns we read, and let Airtable drop unnamed rows
+        "fields[]": [f for f in (name_field, prof_field) if f],
+        "filterByFormula": f"NOT({{{name_field}}} = '')",
+    }
+    if view:
+        params["view"] = view
     
-    clients = []
+    clients = {}
     offset = None
     
-    try:
-        while True:
-            if offset:
-                params["offset"] = offset
-                
-            response = requests.get(url, headers=headers, params=params, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+    while True:
+        if offset:
+            params["offset"] = offset
             
-            for record in data.get("records", []):
-                fields = record.get("fields", {})
-                name = fields.get(AIRTABLE_CLIENT_FIELD, "").strip()
-                profession = fields.get(AIRTABLE_CLIENT_PROF_FIELD, "").strip()
-                
-                if name:
-                    clients.append({"name": name, "profession": profession})
+        response = http_session().get(url, headers=headers, params=params, timeout=30)
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        
+        for record in data.get("records", []):
+            fields = record.get("fields", {})
+            name = fields.get(name_field, "").strip()
+            profession = fields.get(prof_field, "").strip()
             
-            offset = data.get("offset")
-            if not offset:
-                break
-                
-        return clients
-    except Exception as e:
-        st.error(f"Error fetching clients from Airtable: {e}")
-        return []
+            if name:
+                clients.setdefault(name, {"name": name, "profession": profession})
+        
+        offset = data.get("offset")
+        if not offset:
+            break
+            
+    return clients
 
 # --- Enhanced job scraping with multiple strategies ---
-def scrape_jobs_smart(query: str, location: str = "New Zealand"):
+# Keywords that mark an organic result as a job listing (substring, case-insensitive)
+_TITLE_JOB_WORDS_RE = re.compile(r"job|career|position|vacancy|role", re.IGNORECASE)
+_SNIPPET_JOB_WORDS_RE = re.compile(r"job|career|apply|position|vacancy", re.IGNORECASE)
+
+# Known job boards, matched anywhere in an apply link's host
+_BOARD_HOST_RE = re.compile(r"(seek|trademe|indeed|jora)", re.IGNORECASE)
+_BOARD_NAMES = {"seek": "Seek", "trademe": "TradeMe", "indeed": "Indeed", "jora": "Jora"}
+
+def _add_job(jobs: dict, job: dict) -> None:
+    """Keeps the first job seen per (title, company), ignoring case and padding."""
+    key = (job["Position Title"].strip().lower(), job["Company Name"].strip().lower())
+    if key != ("", ""):
+        jobs.setdefault(key, job)
+
+def _site_name(site_query: str) -> str:
+    return site_query.split()[0].replace("site:", "").replace(".co.nz", "").replace(".com", "").title()
+
+@st.cache_resource
+def _scraper_pool() -> ThreadPoolExecutor:
+    """
+    Worker threads for SerpAPI requests, shared across reruns and sessions
+    instead of being created and torn down on every search.
+    """
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="serpapi")
+
+def _fetch_site(session: requests.Session, site_query: str, location: str) -> dict:
+    """
+    Runs one site-restricted Google search. Called from worker threads, so it
+    must not touch st.*; errors propagate to the caller via the future.
+    """
+    params = {
+        "engine": "google",  # Use regular Google search, not google_jobs
+        "q": site_query,
+        "location": location,
+        "api_key": SERPAPI_KEY,
+        "num": 20,  # Get more results
+        "json_restrictor": "error,organic_results",  # Skip unused blocks in the response
+    }
+    return orjson.loads(session.get(SERPAPI_URL, params=params, timeout=30).content)
+
+def _fetch_jobs(session: requests.Session, generic_query: str, location: str) -> dict:
+    """Runs one Google Jobs search for the fallback strategy."""
+    params = {
+        "engine": "google_jobs",  # Try Google Jobs for generic searches
+        "q": generic_query,
+        "location": location,
+        "api_key": SERPAPI_KEY,
+        "json_restrictor": "error,jobs_results",
+    }
+    return orjson.loads(session.get(SERPAPI_URL, params=params, timeout=30).content)
+
+# SerpAPI reports "no results" as an error; that is a real (cacheable) answer, not a failure
+_NO_RESULTS_ERROR = "Google hasn't returned any results"
+
+def _is_search_failure(results: dict) -> bool:
+    return "error" in results and not str(results["error"]).startswith(_NO_RESULTS_ERROR)
+
+class PartialScrapeError(Exception):
+    """
+    Raised by scrape_jobs_smart when any search failed. st.cache_data doesn't
+    store calls that raise, so degraded results are never served from cache;
+    the caller still shows what was found via .jobs and .log.
     """
-    Multi-strategy job search that tries different approaches to find jobs
+    def __init__(self, jobs: list, log: list):
+        super().__init__("One or more searches failed")
+        self.jobs = jobs
+        self.log = log
+
+@st.cache_data(ttl=600, max_entries=64, show_spinner=False)
+def scrape_jobs_smart(query: str, location: str = "New Zealand", refresh_token: int = 0):
+    """
+    Multi-strategy job search that tries different approaches to find jobs.
+    Returns (jobs, log): the function makes no st.* calls, so results are
+    cached per (query, location) and the caller renders the progress log.
+    refresh_token is only part of the cache key: pass a new value to bypass
+    the cached result for this query without clearing anyone else's.
+    Raises PartialScrapeError instead of returning if any search failed.
     """
     if not SERPAPI_KEY:
         raise ValueError("SERPAPI_KEY is required in Streamlit secrets")
     
-    all_jobs = []
+    log = []
+    failed = False
+    
+    # Unique jobs keyed by normalised (title, company); first occurrence wins
+    all_jobs = {}
     
     # Strategy 1: Direct site searches (most effective)
     site_strategies = [
@@ -82,29 +200,27 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
         f"site:jora.co.nz {query}",
     ]
     
-    for i, site_query in enumerate(site_strategies):
-        site_name = site_query.split()[0].replace("site:", "").replace(".co.nz", "").replace(".com", "").title()
+    # The site searches are independent, so run them concurrently and handle the
+    # responses in strategy order on this thread (workers must not touch Streamlit state).
+    session = http_session()
+    executor = _scraper_pool()
+    futures = [executor.submit(_fetch_site, session, site_query, location) for site_query in site_strategies]
+    for site_query in site_strategies:
+        log.append(f"🔍 Searching {_site_name(site_query)}...")
+    
+    for site_query, future in zip(site_strategies, futures):
+        site_name = _site_name(site_query)
         
         try:
-            st.write(f"🔍 Searching {site_name}...")
-            
-            params = {
-                "engine": "google",  # Use regular Google search, not google_jobs
-                "q": site_query,
-                "location": location,
-                "api_key": SERPAPI_KEY,
-                "num": 20,  # Get more results
-            }
-            
-            search = GoogleSearch(params)
-            results = search.get_dict()
+            results = future.result()
             
             if "error" in results:
-                st.write(f"❌ {site_name} error: {results['error']}")
+                failed = failed or _is_search_failure(results)
+                log.append(f"❌ {site_name} error: {results['error']}")
                 continue
             
             organic_results = results.get("organic_results", [])
-            site_jobs = []
+            site_found = 0
             
             for result in organic_results:
                 title = result.get("title", "")
@@ -112,9 +228,8 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
                 snippet = result.get("snippet", "")
                 
                 # Skip non-job results
-                if not any(word in title.lower() for word in ["job", "career", "position", "vacancy", "role"]):
-                    if not any(word in snippet.lower() for word in ["job", "career", "apply", "position", "vacancy"]):
-                        continue
+                if not (_TITLE_JOB_WORDS_RE.search(title) or _SNIPPET_JOB_WORDS_RE.search(snippet)):
+                    continue
                 
                 # Extract company and location from snippet/title
                 company = ""
@@ -129,16 +244,17 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
                         company = parts[-1].strip()
                 
                 # Try to extract location
-                if "auckland" in snippet.lower():
+                snippet_lower = snippet.lower()
+                if "auckland" in snippet_lower:
                     job_location = "Auckland"
-                elif "wellington" in snippet.lower():
+                elif "wellington" in snippet_lower:
                     job_location = "Wellington"
-                elif "christchurch" in snippet.lower():
+                elif "christchurch" in snippet_lower:
                     job_location = "Christchurch"
-                elif "new zealand" in snippet.lower():
+                elif "new zealand" in snippet_lower:
                     job_location = "New Zealand"
                 
-                site_jobs.append({
+                _add_job(all_jobs, {
                     "Source": site_name,
                     "Position Title": title,
                     "Company Name": company,
@@ -147,14 +263,13 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
                     "Application Weblink": link,
                     "Description": snippet[:200] + "..." if len(snippet) > 200 else snippet
                 })
+                site_found += 1
             
-            all_jobs.extend(site_jobs)
-            st.write(f"✅ {site_name}: Found {len(site_jobs)} jobs")
-            
-            time.sleep(1)  # Rate limiting
+            log.append(f"✅ {site_name}: Found {site_found} jobs")
             
         except Exception as e:
-            st.write(f"❌ {site_name} error: {str(e)}")
+            failed = True
+            log.append(f"❌ {site_name} error: {str(e)}")
             continue
     
     # Strategy 2: Generic job searches if we don't have enough results
@@ -165,24 +280,18 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
             f'{query} position {location}',
         ]
         
+        # Run serially: each query is a paid search, and we stop as soon as there are enough jobs
         for generic_query in generic_queries:
             if len(all_jobs) >= 20:  # Stop if we have enough
                 break
                 
             try:
-                st.write(f"🔍 Trying: {generic_query}")
+                log.append(f"🔍 Trying: {generic_query}")
                 
-                params = {
-                    "engine": "google_jobs",  # Try Google Jobs for generic searches
-                    "q": generic_query,
-                    "location": location,
-                    "api_key": SERPAPI_KEY,
-                }
-                
-                search = GoogleSearch(params)
-                results = search.get_dict()
+                results = _fetch_jobs(session, generic_query, location)
                 
                 if "error" in results:
+                    failed = failed or _is_search_failure(results)
                     continue
                 
                 jobs_results = results.get("jobs_results", [])
@@ -202,17 +311,11 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
                     # Determine source from link
                     source = "Web"
                     if apply_link:
-                        host = urlparse(apply_link).netloc.lower()
-                        if "seek" in host:
-                            source = "Seek"
-                        elif "trademe" in host:
-                            source = "TradeMe"
-                        elif "indeed" in host:
-                            source = "Indeed"
-                        elif "jora" in host:
-                            source = "Jora"
+                        board = _BOARD_HOST_RE.search(urlparse(apply_link).netloc)
+                        if board:
+                            source = _BOARD_NAMES[board.group(1).lower()]
                     
-                    all_jobs.append({
+                    _add_job(all_jobs, {
                         "Source": source,
                         "Position Title": title,
                         "Company Name": company,
@@ -222,42 +325,64 @@ def scrape_jobs_smart(query: str, location: str = "New Zealand"):
                         "Description": job.get("description", "")[:200] + "..."
                     })
                 
-                st.write(f"✅ Generic search: Found {len(jobs_results)} additional jobs")
-                time.sleep(1)
+                log.append(f"✅ Generic search: Found {len(jobs_results)} additional jobs")
                 
             except Exception as e:
-                st.write(f"❌ Generic search error: {str(e)}")
+                failed = True
+                log.append(f"❌ Generic search error: {str(e)}")
                 continue
     
-    # Remove duplicates based on title + company
-    unique_jobs = []
-    seen = set()
-    
-    for job in all_jobs:
-        key = (job.get("Position Title", "").lower().strip(), 
-               job.get("Company Name", "").lower().strip())
-        if key not in seen and key != ("", ""):
-            seen.add(key)
-            unique_jobs.append(job)
-    
-    return unique_jobs
+    if failed:
+        raise PartialScrapeError(list(all_jobs.values()), log)
+    return list(all_jobs.values()), log
+
+# Anything other than letters, digits, "_" or "-" is dropped from filenames
+_FILENAME_BAD_CHARS_RE = re.compile(r"[^\w-]+")
 
 def normalize_filename(text: str) -> str:
     text = text.strip().replace(" ", "_")
-    return "".join(c for c in text if c.isalnum() or c in ("_", "-"))[:50]
+    return _FILENAME_BAD_CHARS_RE.sub("", text)[:50]
+
+def columns_to_csv_bytes(columns: dict[str, list]) -> bytes:
+    """
+    Writes column lists straight to CSV (UTF-8 with BOM for Excel)
+    without going through a DataFrame. Rows are encoded as they are
+    written, so no intermediate str copy of the whole file is built.
+    """
+    buf = io.BytesIO()
+    with io.TextIOWrapper(buf, encoding="utf-8-sig", newline="", write_through=True) as text:
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        writer.writerows(zip(*columns.values()))
+        return buf.getvalue()
 
 # --- UI ---
 col1, col2 = st.columns([1, 2])
 
 with col1:
-    clients_data = fetch_clients()
+    if st.button("🔄 Refresh clients"):
+        fetch_clients.clear()
+    
+    # Errors are reported here rather than inside the cached fetch, so a
+    # transient failure isn't cached and the next rerun tries again
+    try:
+        clients_data = fetch_clients(
+            AIRTABLE_BASE_ID,
+            AIRTABLE_CLIENTS_TABLE,
+            AIRTABLE_VIEW,
+            AIRTABLE_CLIENT_FIELD,
+            AIRTABLE_CLIENT_PROF_FIELD,
+            AIRTABLE_API_KEY,
+        )
+    except Exception as e:
+        st.error(f"Error fetching clients from Airtable: {e}")
+        clients_data = {}
     
     if clients_data:
-        client_names = [client["name"] for client in clients_data]
-        selected_client_name = st.selectbox("Choose a client", client_names)
+        selected_client_name = st.selectbox("Choose a client", list(clients_data))
         
-        selected_client = next(
-            (client for client in clients_data if client["name"] == selected_client_name), 
+        selected_client = clients_data.get(
+            selected_client_name,
             {"name": selected_client_name, "profession": ""}
         )
         
@@ -287,6 +412,7 @@ st.info("💡 **Search Tips:** Use simple job titles (e.g., 'teacher', 'engineer
 
 # Run button
 run_scraper = st.button("🔍 Run Scraper", type="primary")
+force_refresh = st.checkbox("Force refresh", help="Ignore cached results and query SerpAPI again")
 
 # Execute scraping
 if run_scraper:
@@ -309,50 +435,91 @@ if run_scraper:
             st.write(f"**Profession:** {selected_client['profession']}")
         st.write(f"**Query:** {query}")
         
+        # Per-query token for this session: a forced refresh re-runs only this
+        # query, and later runs here keep using the refreshed entry
+        refresh_tokens = st.session_state.setdefault("refresh_tokens", {})
+        if force_refresh:
+            refresh_tokens[query] = time.time_ns()
+        
         try:
-            jobs = scrape_jobs_smart(query)
-            status.update(label="✅ Search completed!", state="complete")
+            jobs, search_log = scrape_jobs_smart(query, refresh_token=refresh_tokens.get(query, 0))
+            complete_label = "✅ Search completed!"
+        except PartialScrapeError as e:
+            # Show what we got, but it wasn't cached, so the next run retries
+            jobs, search_log = e.jobs, e.log
+            complete_label = "⚠️ Search completed with errors (results not cached)"
         except Exception as e:
             st.error(f"Search failed: {e}")
             st.stop()
+        
+        # One markdown block instead of a separate element per progress line
+        st.markdown("\n\n".join(search_log))
+        status.update(label=complete_label, state="complete")
     
     if not jobs:
+        st.session_state.pop("results", None)
         st.warning("No jobs found for this query. Try:")
         st.write("• Simpler terms: 'teacher' instead of 'primary school teacher'")
         st.write("• Different keywords: 'health safety' instead of 'HSE'")
         st.write("• Broader terms: 'engineer' instead of 'mechanical engineer'")
     else:
-        # Create DataFrame
-        df = pd.DataFrame(jobs)
-        
-        # Add client information
-        df.insert(0, "Client", selected_client["name"])
+        # Assemble all columns (client info first) with a fixed schema; st.dataframe
+        # and the CSV writer both take these lists directly, so no DataFrame is built
+        columns = {"Client": [selected_client["name"]] * len(jobs)}
         if selected_client.get("profession"):
-            df.insert(1, "Client Profession", selected_client["profession"])
-        
-        st.success(f"Found {len(jobs)} jobs!")
+            columns["Client Profession"] = [selected_client["profession"]] * len(jobs)
+        for col in JOB_COLUMNS:
+            columns[col] = [job.get(col, "") for job in jobs]
         
-        # Display results
-        st.dataframe(df, use_container_width=True)
-        
-        # Download button
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         client_safe = normalize_filename(selected_client["name"])
-        filename = f"{client_safe}_jobs_{timestamp}.csv"
-        
-        csv_data = df.to_csv(index=False)
-        st.download_button(
-            label="⬇️ Download CSV",
-            data=csv_data,
-            file_name=filename,
-            mime="text/csv"
-        )
         
-        # Show summary
-        st.markdown("### Results Summary")
-        source_counts = df["Source"].value_counts()
-        for source, count in source_counts.items():
-            st.write(f"• {source}: {count} jobs")
+        # Build the CSV once per scrape; later reruns render from session state
+        # instead of rebuilding
+        st.session_state["results"] = {
+            "client": selected_client["name"],
+            "query": query,
+            "columns": columns,
+            "csv": columns_to_csv_bytes(columns),
+            "filename": f"{client_safe}_jobs_{timestamp}.csv",
+        }
+
+# Show the latest results
+results = st.session_state.get("results")
+if results:
+    columns = results["columns"]
+    
+    total = len(columns["Source"])
+    # Results outlive the inputs that produced them, so say which run they are from
+    st.success(f"Found {total} jobs for **{results['client']}** (query: *{results['query']}*)")
+    if (results["client"], results["query"]) != (selected_client["name"], query):
+        st.caption("These are the last results; click Run Scraper to search for the current client and query.")
+    
+    # Display results; large result sets only ship the first rows to the browser,
+    # the download below always has everything
+    show_n = total
+    if total > 50:
+        show_n = st.slider("Rows to show", 10, total, 50)
+    st.dataframe({col: values[:show_n] for col, values in columns.items()}, use_container_width=True)
+    
+    # Download button; "ignore" serves the file without rerunning the script
+    st.download_button(
+        label="⬇️ Download CSV",
+        data=results["csv"],
+        file_name=results["filename"],
+        mime="text/csv",
+        on_click="ignore",
+    )
+    
+    # Show summary
+    st.markdown("### Results Summary")
+    # bar_chart sorts the sources alphabetically, so no ordering is applied here
+    source_counts = Counter(columns["Source"])
+    st.bar_chart(
+        {"Source": list(source_counts), "Jobs": list(source_counts.values())},
+        x="Source",
+        y="Jobs",
+    )
 
 # Footer
 st.markdown("---")
@@ -1,10 +1,22 @@
 # csv_scraper/scraper_serp.py
 # Google Jobs via SerpAPI (Seek-friendly) with next_page_token pagination
 
+import functools
+import hashlib
 import os
-import time
-from urllib.parse import urlparse
-from serpapi import GoogleSearch
+import re
+from collections.abc import Callable
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
+
+import orjson
+
+from csv_scraper.session import retrying_session
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+# One pooled session for all pages; SerpAPI's error body still reaches the
+# "error" check below after any retries
+_SESSION = retrying_session()
 
 
 def _first_nonempty(*vals):
@@ -14,26 +26,72 @@ def _first_nonempty(*vals):
     return ""
 
 
+# Matches seek hosts and their subdomains (e.g. nz.seek.co.nz) by suffix
+_SEEK_HOST_RE = re.compile(r"(?:^|\.)(?:seek\.co\.nz|seek\.com\.au|seek\.com)$")
+
+
+@functools.lru_cache(maxsize=4096)
 def _is_seek(url: str) -> bool:
-    host = urlparse(url or "").netloc.lower()
-    return any(d in host for d in ("seek.co.nz", "seek.com.au", "seek.com", "nz.seek.co.nz"))
+    # hostname (not netloc) is lowercased and drops any port or userinfo,
+    # so the $-anchored suffix match sees the bare host
+    return bool(_SEEK_HOST_RE.search(urlparse(url or "").hostname or ""))
+
+
+_TRACKING_PARAMS = frozenset({"ref", "gclid", "fbclid"})
+
+
+def _canonical_link(url: str) -> str:
+    """
+    Drops tracking query params, the fragment and any trailing slash so the
+    same listing served with different ?utm_... suffixes collapses to one key.
+    Other params are kept: some boards identify the job in the query (?jk=...).
+    """
+    parts = urlsplit(url)
+    query = urlencode([
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith("utm_") and k.lower() not in _TRACKING_PARAMS
+    ])
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path.rstrip("/"), query, ""))
+
+
+def _link_digest(text: str) -> bytes:
+    # 8-byte fingerprint: much smaller than keying rows by long apply URLs
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
 
 
 def scrape_serp_jobs(query: str,
                      location: str = "New Zealand",
                      num_pages: int = 3,
-                     api_key: str | None = None) -> list[dict]:
+                     api_key: str | None = None,
+                     link_filter: Callable[[str], bool] | None = None,
+                     max_empty_pages: int | None = None) -> list[dict]:
     """
     Returns a list[dict] with keys:
       Source, Position Title, Company Name, Location, Posted, Application Weblink
     Uses SerpAPI google_jobs engine and paginates with next_page_token.
+    Listings repeated across pages (same apply link ignoring tracking
+    params, or same title + company when there is no link) are returned
+    once; rows keep the original link.
+    Pages are chained (each token comes from the previous response), so
+    they are fetched back-to-back with no client-side delay; SerpAPI
+    throttles per account, not per request interval.
+
+    If link_filter is given (e.g. _is_seek), only jobs whose apply link it
+    accepts are kept.
+
+    If max_empty_pages is given, paging stops early after that many
+    consecutive pages that add no new row (every job filtered out or
+    already kept). This saves credits but can miss matches on later
+    pages, so it is off by default.
     """
     key = api_key or os.getenv("SERPAPI_KEY") or os.getenv("GOOGLE_API_KEY")
     if not key:
         raise RuntimeError("SerpAPI key missing. Provide SERPAPI_KEY or GOOGLE_API_KEY.")
 
-    rows: list[dict] = []
+    # Keyed by listing fingerprint; insertion order keeps the page order
+    rows: dict[bytes, dict] = {}
     next_token = None
+    empty_pages = 0
     pages_left = max(1, int(num_pages))
 
     while pages_left > 0:
@@ -42,17 +100,21 @@ def scrape_serp_jobs(query: str,
             "q": query,
             "location": location,
             "api_key": key,
+            # Only ask for the parts we read; skips filters, metadata, etc. in the payload
+            "json_restrictor": "error,jobs_results,serpapi_pagination,search_metadata.next_page_token",
         }
         if next_token:
             params["next_page_token"] = next_token
 
-        data = GoogleSearch(params).get_dict()
+        # SerpAPI reports failures in the JSON body, so decode before checking status
+        data = orjson.loads(_SESSION.get(SERPAPI_URL, params=params, timeout=30).content)
 
         # Surface API errors cleanly
         if "error" in data:
             raise RuntimeError(f"SerpAPI error: {data['error']}")
 
         jobs = data.get("jobs_results", []) or []
+        new_rows = 0
         for j in jobs:
             title = j.get("title", "")
             company = j.get("company_name", "")
@@ -65,16 +127,29 @@ def scrape_serp_jobs(query: str,
                 (j.get("apply_options") or [{}])[0].get("link"),
                 j.get("link"),
             )
+            if link_filter and not link_filter(apply_link):
+                continue
+
+            # Later pages can repeat listings; skip ones we've already kept
+            row_key = _link_digest(_canonical_link(apply_link) if apply_link else f"{title}\n{company}")
+            if row_key in rows:
+                continue
+
             src = "Seek" if _is_seek(apply_link) else _first_nonempty(j.get("via"), j.get("source"), "Web")
 
-            rows.append({
+            rows[row_key] = {
                 "Source": src,
                 "Position Title": title,
                 "Company Name": company,
                 "Location": loc,
                 "Posted": posted,
                 "Application Weblink": apply_link,
-            })
+            }
+            new_rows += 1
+
+        # An empty page means the results are exhausted, even if a token came back
+        if not jobs:
+            break
 
         # Prepare next page
         # Token can appear under different keys depending on engine version
@@ -87,6 +162,10 @@ def scrape_serp_jobs(query: str,
         if not next_token:  # no more pages available
             break
 
-        time.sleep(0.6)  # gentle rate limiting
+        # Stop spending credits once pages keep adding nothing new
+        if max_empty_pages is not None:
+            empty_pages = 0 if new_rows else empty_pages + 1
+            if empty_pages >= max_empty_pages:
+                break
 
-    return rows
+    return list(rows.values())
@@ -0,0 +1,27 @@
+# csv_scraper/session.py
+# Pooled requests.Session with retries, shared by the scraper and the app
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def retrying_session() -> requests.Session:
+    """
+    Returns a Session whose GETs are retried with backoff on transient 5xx.
+    Keep-alive on the pooled connections avoids a TCP/TLS handshake per
+    request. After the last retry the response is returned as-is, so
+    callers still see the API's error body.
+    429 is not retried: SerpAPI uses it for "account has run out of
+    searches" and Airtable for a 30-second rate-limit lockout, and a few
+    sub-second retries only delay the error in both cases.
+    """
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(max_retries=Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=(500, 502, 503, 504),
+        allowed_methods=("GET",),
+        raise_on_status=False,
+    )))
+    return session
@@ -0,0 +1,118 @@
+import orjson
+
+from csv_scraper import scraper_serp
+
+
+class _FakeResponse:
+    def __init__(self, data):
+        self.content = orjson.dumps(data)
+
+
+def _job(n, link=None):
+    return {
+        "title": f"Nurse {n}",
+        "company_name": f"Clinic {n}",
+        "apply_link": link or f"https://nz.seek.co.nz/job/{n}",
+    }
+
+
+def _page(n, token, jobs=None):
+    data = {"jobs_results": jobs if jobs is not None else [_job(n)]}
+    if token:
+        data["serpapi_pagination"] = {"next_page_token": token}
+    return data
+
+
+def _stub_pages(monkeypatch, pages):
+    """Serves pages in order from scraper_serp._SESSION.get; returns the params sent."""
+    sent = []
+
+    def fake_get(url, params=None, timeout=None):
+        sent.append(dict(params))
+        return _FakeResponse(pages[len(sent) - 1])
+
+    monkeypatch.setattr(scraper_serp._SESSION, "get", fake_get)
+    return sent
+
+
+def _titles(rows):
+    return [r["Position Title"] for r in rows]
+
+
+def test_paging_keeps_api_key_on_every_page(monkeypatch):
+    sent = _stub_pages(monkeypatch, [_page(1, "t2"), _page(2, "t3"), _page(3, None)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", num_pages=3, api_key="REALKEY")
+
+    assert [p["api_key"] for p in sent] == ["REALKEY"] * 3
+    assert [p.get("next_page_token") for p in sent] == [None, "t2", "t3"]
+    assert _titles(rows) == ["Nurse 1", "Nurse 2", "Nurse 3"]
+
+
+def test_is_seek_matches_host_suffix_ignoring_port_and_case():
+    assert scraper_serp._is_seek("https://seek.co.nz:443/job/1")
+    assert scraper_serp._is_seek("https://user@NZ.Seek.co.nz/job/1")
+    assert not scraper_serp._is_seek("https://notseek.co.nz/job/1")
+    assert not scraper_serp._is_seek("")
+
+
+def test_link_filter_keeps_only_accepted_links(monkeypatch):
+    jobs = [_job(1), _job(2, "https://www.trademe.co.nz/jobs/2"), _job(3)]
+    _stub_pages(monkeypatch, [_page(1, None, jobs)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", api_key="K", link_filter=scraper_serp._is_seek)
+
+    assert _titles(rows) == ["Nurse 1", "Nurse 3"]
+    assert {r["Source"] for r in rows} == {"Seek"}
+
+
+def test_later_matches_are_kept_without_max_empty_pages(monkeypatch):
+    other = [_job(0, "https://www.trademe.co.nz/jobs/0")]
+    sent = _stub_pages(monkeypatch, [_page(1, "t2", other), _page(2, "t3", other), _page(3, None)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", num_pages=3, api_key="K",
+                                         link_filter=scraper_serp._is_seek)
+
+    assert len(sent) == 3
+    assert _titles(rows) == ["Nurse 3"]
+
+
+def test_max_empty_pages_stops_after_pages_with_no_new_rows(monkeypatch):
+    other = [_job(0, "https://www.trademe.co.nz/jobs/0")]
+    sent = _stub_pages(monkeypatch, [_page(1, "t2", other), _page(2, "t3", other), _page(3, None)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", num_pages=3, api_key="K",
+                                         link_filter=scraper_serp._is_seek, max_empty_pages=2)
+
+    assert len(sent) == 2
+    assert rows == []
+
+
+def test_repeated_listings_count_as_empty_pages(monkeypatch):
+    sent = _stub_pages(monkeypatch, [_page(1, "t2"), _page(1, "t3"), _page(1, "t4"), _page(4, None)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", num_pages=4, api_key="K",
+                                         link_filter=scraper_serp._is_seek, max_empty_pages=2)
+
+    assert len(sent) == 3
+    assert _titles(rows) == ["Nurse 1"]
+
+
+def test_canonical_link_drops_tracking_params_fragment_and_trailing_slash():
+    canonical = scraper_serp._canonical_link
+
+    assert canonical("https://NZ.Seek.co.nz/job/1/?utm_source=g&ref=x&gclid=1#top") == \
+        "https://nz.seek.co.nz/job/1"
+    assert canonical("https://nz.indeed.com/viewjob?jk=abc&UTM_medium=cpc&fbclid=2") == \
+        "https://nz.indeed.com/viewjob?jk=abc"
+
+
+def test_links_differing_only_in_tracking_params_are_one_row(monkeypatch):
+    jobs = [_job(1, "https://nz.seek.co.nz/job/1?utm_source=a"),
+            _job(2, "https://nz.seek.co.nz/job/1/?utm_source=b")]
+    _stub_pages(monkeypatch, [_page(1, None, jobs)])
+
+    rows = scraper_serp.scrape_serp_jobs("nurse", api_key="K")
+
+    assert _titles(rows) == ["Nurse 1"]
+    assert rows[0]["Application Weblink"] == "https://nz.seek.co.nz/job/1?utm_source=a"